@@ -14,24 +14,107 @@
 # limitations under the License.
 """DFDewey Config."""
 
-import importlib.machinery
-import importlib.util
+import functools
 import logging
 import os
+import tempfile
+import types
 
-CONFIG_ENV = [
-    'PG_HOST', 'PG_PORT', 'PG_DB_NAME', 'OS_HOST', 'OS_PORT', 'OS_URL'
-]
+CONFIG_ENV = (
+    'PG_HOST', 'PG_PORT', 'PG_DB_NAME', 'OS_HOST', 'OS_PORT', 'OS_URL')
+# Config line formats and value conversions, keyed by whether the setting is a
+# port
+_ENV_FORMATS = {
+    True: ('{0:s} = {1:d}\n', int),
+    False: ('{0:s} = \'{1:s}\'\n', str),
+}
+# Environment variable, config line format and value conversion for each config
+# setting
+_ENV_SPEC = tuple((config_var, 'DFDEWEY_{0:s}'.format(config_var)) +
+                  _ENV_FORMATS['PORT' in config_var]
+                  for config_var in CONFIG_ENV)
 CONFIG_FILE = '.dfdeweyrc'
 # Look in homedir first, then current dir
 CONFIG_PATH = [
     os.path.expanduser('~'),
     os.path.dirname(os.path.abspath(__file__)),
 ]
+_CANDIDATE_PATHS = tuple(
+    os.path.join(path, CONFIG_FILE) for path in CONFIG_PATH)
+
+# Loaded config modules, keyed by path, along with the file's modification time
+# and size
+_CONFIG_CACHE = {}
 
 log = logging.getLogger('dfdewey')
 
 
+@functools.lru_cache(maxsize=1)
+def _find_config_file():
+  """Looks for a config file in the default locations.
+
+  Returns:
+    str: path to the config file, or None if one could not be found.
+  """
+  for config_file in _CANDIDATE_PATHS:
+    if os.path.isfile(config_file):
+      return config_file
+  return None
+
+
+def _load_from(config_file, source=None):
+  """Loads a config file.
+
+  The loaded module is cached and reused until the file is modified.
+
+  Args:
+    config_file(str): full path to config file
+    source(str): contents of the config file if already known
+
+  Returns:
+    The loaded config module.
+
+  Raises:
+    FileNotFoundError: if the config file does not exist.
+  """
+  stat = os.stat(config_file)
+  file_version = (stat.st_mtime_ns, stat.st_size)
+  cached = _CONFIG_CACHE.get(config_file)
+  if cached and cached[0] == file_version:
+    return cached[1]
+
+  if source is None:
+    with open(config_file, 'rb') as f:
+      source = f.read()
+  config = types.ModuleType('config')
+  config.__file__ = config_file
+  # pylint: disable=exec-used
+  exec(compile(source, config_file, 'exec'), config.__dict__)
+  _CONFIG_CACHE[config_file] = (file_version, config)
+  return config
+
+
+def _write_config(config_file, config_str):
+  """Atomically writes a config file.
+
+  The config is written to a temporary file in the same directory, which then
+  replaces the config file.
+
+  Args:
+    config_file(str): full path to config file
+    config_str(str): contents of the config file
+  """
+  fd, temp_file = tempfile.mkstemp(
+      dir=os.path.dirname(config_file), prefix=CONFIG_FILE)
+  try:
+    with os.fdopen(fd, 'w') as f:
+      f.write(config_str)
+    os.replace(temp_file, config_file)
+  except OSError:
+    os.remove(temp_file)
+    raise
+
+
 def load_config(config_file=None):
   """Finds dfDewey config file and loads it.
 
@@ -41,40 +124,35 @@ def load_config(config_file=None):
   config = None
   if not config_file:
     log.debug('No config file specified. Looking in default locations.')
-    for path in CONFIG_PATH:
-      if os.path.exists(os.path.join(path, CONFIG_FILE)):
-        config_file = os.path.join(path, CONFIG_FILE)
-        break
+    config_file = _find_config_file()
     if not config_file:
       # If we still don't have a config file, check the environment variables
       valid_config = True
-      config_str = ''
-      for config_var in CONFIG_ENV:
-        config_env = os.environ.get('_'.join(('DFDEWEY', config_var)))
+      config_lines = []
+      env = os.environ
+      for config_var, env_key, line_format, convert in _ENV_SPEC:
+        config_env = env.get(env_key)
         if not config_env:
           if config_var == 'OS_URL':
-            config_str += '{0:s} = {1:s}\n'.format(config_var, 'None')
+            config_lines.append('{0:s} = {1:s}\n'.format(config_var, 'None'))
             break
           else:
             valid_config = False
             break
-        if 'PORT' in config_var:
-          config_str += '{0:s} = {1:d}\n'.format(config_var, int(config_env))
-        else:
-          config_str += '{0:s} = \'{1:s}\'\n'.format(config_var, config_env)
+        config_lines.append(line_format.format(config_var, convert(config_env)))
+      config_str = ''.join(config_lines)
 
       if valid_config:
         config_file = os.path.join(CONFIG_PATH[0], CONFIG_FILE)
-        with open(config_file, 'w') as f:
-          f.write(config_str)
+        _write_config(config_file, config_str)
+        _find_config_file.cache_clear()
+        log.debug('Loading config from environment variables')
+        config = _load_from(config_file, config_str)
 
-  if config_file:
+  if config_file and not config:
     log.debug('Loading config from {0:s}'.format(config_file))
     try:
-      spec = importlib.util.spec_from_loader(
-          'config', importlib.machinery.SourceFileLoader('config', config_file))
-      config = importlib.util.module_from_spec(spec)
-      spec.loader.exec_module(config)
+      config = _load_from(config_file)
     except FileNotFoundError as e:
       log.error(
           'Could not load config file {0:s}: {1!s}'.format(config_file, e))
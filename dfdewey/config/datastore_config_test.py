@@ -28,6 +28,7 @@ class DatastoreConfigTest(unittest.TestCase):
 
   def setUp(self):
     self.config_file = tempfile.mkstemp()[1]
+    dfdewey_config._find_config_file.cache_clear()
 
   def tearDown(self):
     os.remove(self.config_file)
@@ -45,7 +46,7 @@ class DatastoreConfigTest(unittest.TestCase):
       config_file_handle.write(text)
 
   @mock.patch('os.environ.get')
-  @mock.patch('os.path.exists')
+  @mock.patch('os.path.isfile')
   def test_load_config(self, mock_path_exists, mock_env):
     """Test load config method."""
     # Test if config doesn't exist
@@ -63,16 +64,32 @@ class DatastoreConfigTest(unittest.TestCase):
     self.assertEqual(config.PG_HOST, '127.0.0.1')
     self.assertEqual(config.PG_PORT, 5432)
 
+    # Test config is reused until the file is modified
+    self.assertIs(dfdewey_config.load_config(self.config_file), config)
+    self._write_config('PG_HOST = \'127.0.0.2\'\nPG_PORT = 5432')
+    os.utime(self.config_file, ns=(0, 0))
+    config = dfdewey_config.load_config(self.config_file)
+    self.assertEqual(config.PG_HOST, '127.0.0.2')
+    # Same modification time, different size
+    self._write_config('PG_HOST = \'db.example.com\'\nPG_PORT = 5432')
+    os.utime(self.config_file, ns=(0, 0))
+    config = dfdewey_config.load_config(self.config_file)
+    self.assertEqual(config.PG_HOST, 'db.example.com')
+
     # Test error opening specified config file
     config = dfdewey_config.load_config('/tmp/does-not-exist')
     self.assertIsNone(config)
 
     # Test loading config from environment variable
     mock_env.return_value = '1234'
-    mock_open = mock.mock_open()
-    with mock.patch('dfdewey.config.open', mock_open, create=True):
+    config_dir = tempfile.mkdtemp()
+    with mock.patch.object(dfdewey_config, 'CONFIG_PATH', [config_dir]):
       config = dfdewey_config.load_config()
-      mock_open.assert_called_once_with(
-          os.path.join(os.path.expanduser('~'), '.dfdeweyrc'), 'w')
-      mock_file_handle = mock_open()
-      mock_file_handle.write.assert_called_once()
+    config_file = os.path.join(config_dir, '.dfdeweyrc')
+    self.assertEqual(os.listdir(config_dir), ['.dfdeweyrc'])
+    self.assertEqual(config.PG_HOST, '1234')
+    self.assertEqual(config.PG_PORT, 1234)
+    self.assertEqual(config.OS_URL, '1234')
+    self.assertIs(dfdewey_config.load_config(config_file), config)
+    os.remove(config_file)
+    os.rmdir(config_dir)
@@ -13,3 +13,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """DFDewey Datastore Package."""
+
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+  """Imports a module lazily.
+
+  The module is registered in sys.modules straight away, but its code is not
+  executed until one of its attributes is first accessed.
+
+  Args:
+    name (str): name of the module to import.
+
+  Returns:
+    The (possibly not yet loaded) module.
+
+  Raises:
+    ImportError: if the module cannot be found.
+  """
+  module = sys.modules.get(name)
+  if module is not None:
+    return module
+
+  spec = importlib.util.find_spec(name)
+  if spec is None:
+    raise ImportError('No module named {0:s}'.format(name), name=name)
+  loader = importlib.util.LazyLoader(spec.loader)
+  spec.loader = loader
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  loader.exec_module(module)
+  return module
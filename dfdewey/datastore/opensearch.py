@@ -14,10 +14,18 @@
 # limitations under the License.
 """Opensearch datastore."""
 
-import collections
+import json
+import logging
 
-from opensearchpy import OpenSearch
-from opensearchpy import exceptions
+from dfdewey.datastore import lazy_import
+
+opensearchpy = lazy_import('opensearchpy')
+
+log = logging.getLogger('dfdewey.opensearch')
+
+# OpenSearch clients, keyed by URL or (host, port). Sharing clients means their
+# HTTP connections are kept alive and reused.
+_CLIENTS = {}
 
 
 class OpenSearchDataStore():
@@ -25,17 +33,45 @@ class OpenSearchDataStore():
 
   # Number of events to queue up when bulk inserting events.
   DEFAULT_FLUSH_INTERVAL = 20000
+  # Maximum size in bytes of a single bulk request.
+  DEFAULT_MAX_CHUNK_BYTES = 10 * 1024 * 1024
   DEFAULT_SIZE = 1000  # Max events to return
+  # Maximum number of HTTP connections per client.
+  MAX_CONNECTIONS = 10
+  # Number of threads sending bulk requests concurrently.
+  DEFAULT_THREAD_COUNT = 4
 
   def __init__(self, host='127.0.0.1', port=9200, url=None):
     """Create an OpenSearch client."""
     super().__init__()
     if url:
-      self.client = OpenSearch([url], timeout=30)
+      self._client_key = url
+      self._hosts = [url]
     else:
-      self.client = OpenSearch([{'host': host, 'port': port}], timeout=30)
-    self.import_counter = collections.Counter()
+      self._client_key = (host, port)
+      self._hosts = [{'host': host, 'port': port}]
+    self.import_count = 0
+    # Queued NDJSON lines of the next bulk request
     self.import_events = []
+    # Serialised bulk headers, keyed by index name
+    self._bulk_headers = {}
+    # Cached results of index existence checks, keyed by index name
+    self._index_exists = {}
+
+  @property
+  def client(self):
+    """OpenSearch client.
+
+    The client is created on first use and shared between datastores connecting
+    to the same server.
+    """
+    client = _CLIENTS.get(self._client_key)
+    if client is None:
+      client = opensearchpy.OpenSearch(
+          self._hosts, timeout=30, maxsize=self.MAX_CONNECTIONS,
+          retry_on_timeout=True)
+      _CLIENTS[self._client_key] = client
+    return client
 
   @staticmethod
   def build_query(query_string):
@@ -62,6 +98,53 @@ class OpenSearchDataStore():
 
     return query_dsl
 
+  @staticmethod
+  def _serialise(document):
+    """Serialise a document to a line of a bulk request.
+
+    Args:
+      document: Dictionary to serialise
+
+    Returns:
+      NDJSON line as bytes.
+    """
+    return json.dumps(document, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8') + b'\n'
+
+  def bulk_import_events(
+      self, index_name, events, flush_interval=DEFAULT_FLUSH_INTERVAL,
+      thread_count=DEFAULT_THREAD_COUNT):
+    """Add multiple events to OpenSearch.
+
+    Events are sent to OpenSearch in chunks as the iterable is consumed. Chunks
+    are sent by a pool of threads, so building the next chunk overlaps with
+    indexing of the previous ones.
+
+    Args:
+      index_name: Name of the index in OpenSearch
+      events: Iterable of event dictionaries
+      flush_interval: Number of events to queue up before indexing
+      thread_count: Number of threads sending bulk requests
+
+    Returns:
+      The number of events processed.
+    """
+    actions = ({
+        '_op_type': 'index',
+        '_index': index_name,
+        '_source': event
+    } for event in events)
+    for success, item in opensearchpy.helpers.parallel_bulk(
+        self.client, actions, thread_count=thread_count,
+        chunk_size=int(flush_interval),
+        max_chunk_bytes=self.DEFAULT_MAX_CHUNK_BYTES,
+        queue_size=thread_count * 2, raise_on_error=False):
+      self.import_count += 1
+      if not success:
+        log.warning('Failed to index event: {0!s}'.format(item))
+
+    return self.import_count
+
   def create_index(self, index_name):
     """Create an index.
 
@@ -71,11 +154,12 @@ class OpenSearchDataStore():
     Returns:
       Index name in string format.
     """
-    if not self.client.indices.exists(index_name):
+    if not self.index_exists(index_name):
       try:
         self.client.indices.create(index=index_name)
-      except exceptions.ConnectionError as e:
+      except opensearchpy.exceptions.ConnectionError as e:
         raise RuntimeError('Unable to connect to backend datastore.') from e
+      self._index_exists[index_name] = True
 
     return index_name
 
@@ -85,11 +169,12 @@ class OpenSearchDataStore():
     Args:
       index_name: Name of the index to delete.
     """
-    if self.client.indices.exists(index_name):
+    if self.index_exists(index_name):
       try:
         self.client.indices.delete(index=index_name)
-      except exceptions.ConnectionError as e:
+      except opensearchpy.exceptions.ConnectionError as e:
         raise RuntimeError('Unable to connect to backend datastore.') from e
+      self._index_exists[index_name] = False
 
   def import_event(
       self, index_name, event=None, flush_interval=DEFAULT_FLUSH_INTERVAL):
@@ -104,55 +189,84 @@ class OpenSearchDataStore():
       The number of events processed.
     """
     if event:
-      # Header needed by OpenSearch when bulk inserting.
-      header = {'index': {'_index': index_name}}
+      # Header needed by OpenSearch when bulk inserting. It only depends on the
+      # index name, so is serialised once.
+      header = self._bulk_headers.get(index_name)
+      if header is None:
+        header = self._serialise({'index': {'_index': index_name}})
+        self._bulk_headers[index_name] = header
 
       self.import_events.append(header)
-      self.import_events.append(event)
-      self.import_counter['events'] += 1
+      self.import_events.append(self._serialise(event))
+      self.import_count += 1
 
-      if self.import_counter['events'] % int(flush_interval) == 0:
-        self.client.bulk(body=self.import_events)
+      if self.import_count % flush_interval == 0:
+        self.client.bulk(body=b''.join(self.import_events))
         self.import_events = []
     else:
       # Import the remaining events in the queue.
       if self.import_events:
-        self.client.bulk(body=self.import_events)
+        self.client.bulk(body=b''.join(self.import_events))
+        self.import_events = []
 
-    return self.import_counter['events']
+    return self.import_count
 
   def index_exists(self, index_name):
     """Check if an index already exists.
 
+    The result is cached, and kept up to date when the index is created or
+    deleted through this datastore.
+
     Args:
       index_name: Name of the index
 
     Returns:
       True if the index exists, False if not.
     """
-    return self.client.indices.exists(index_name)
-
-  def search(self, index_id, query_string, size=DEFAULT_SIZE):
+    exists = self._index_exists.get(index_name)
+    if exists is None:
+      exists = bool(self.client.indices.exists(index=index_name))
+      self._index_exists[index_name] = exists
+    return exists
+
+  def search(
+      self, index_id, query_string, size=DEFAULT_SIZE, source_includes=None,
+      sort=None, search_after=None):
     """Search OpenSearch.
 
     This will take a query string from the UI together with a filter definition.
     Based on this it will execute the search request on OpenSearch and get the
     result back.
 
+    Results beyond the first page can be retrieved by sorting the results and
+    passing the sort values of the last hit as search_after.
+
     Args:
       index_id: Index to be searched
       query_string: Query string
       size: Maximum number of results to return
+      source_includes: Fields of each document to return, or None for all
+      sort: Sort order of the results
+      search_after: Sort values of the last hit of the previous page
 
     Returns:
       Set of event documents in JSON format
     """
 
     query_dsl = self.build_query(query_string)
+    if sort:
+      query_dsl['sort'] = sort
+    if search_after:
+      query_dsl['search_after'] = search_after
+
+    search_kwargs = {}
+    if source_includes is not None:
+      search_kwargs['_source_includes'] = list(source_includes)
 
     # Default search type for OpenSearch is query_then_fetch.
     search_type = 'query_then_fetch'
 
     # pylint: disable=unexpected-keyword-arg
     return self.client.search(
-        body=query_dsl, index=index_id, size=size, search_type=search_type)
+        body=query_dsl, index=index_id, size=size, search_type=search_type,
+        **search_kwargs)
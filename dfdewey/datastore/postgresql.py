@@ -14,81 +14,255 @@
 # limitations under the License.
 """PostgreSQL datastore."""
 
-import psycopg2
-from psycopg2 import extras
+import csv
+import io
+import itertools
+import threading
+
+from dfdewey.datastore import lazy_import
+
+psycopg2 = lazy_import('psycopg2')
+
+# Maximum number of connections to each database. Only one idle connection is
+# kept open for reuse.
+MAX_CONNECTIONS = 8
+
+# Connection pools, keyed by (host, port, db_name).
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+# Used to give each server-side cursor a unique name.
+_CURSOR_IDS = itertools.count()
+
+
+def _close_pools(db_name):
+  """Closes all connection pools to a database.
+
+  Args:
+    db_name: Name of the database
+  """
+  with _POOLS_LOCK:
+    for key in [key for key in _POOLS if key[2] == db_name]:
+      _POOLS.pop(key).closeall()
+
+
+def _get_pool(host, port, db_name):
+  """Gets the connection pool for a database, creating it if required.
+
+  Args:
+    host: Hostname or IP address of the PostgreSQL server
+    port: Port of the PostgreSQL server
+    db_name: Name of the database
+
+  Returns:
+    A psycopg2 ThreadedConnectionPool.
+  """
+  key = (host, port, db_name)
+  with _POOLS_LOCK:
+    connection_pool = _POOLS.get(key)
+    if connection_pool is None:
+      from psycopg2 import pool  # pylint: disable=import-outside-toplevel
+      connection_pool = pool.ThreadedConnectionPool(
+          1, MAX_CONNECTIONS, database=db_name, user='dfdewey',
+          password='password', host=host, port=port)
+      _POOLS[key] = connection_pool
+  return connection_pool
 
 
 class PostgresqlDataStore():
   """Implements the datastore."""
 
+  # Minimum number of rows to bulk insert using COPY rather than INSERT.
+  COPY_THRESHOLD = 1000
+  # Number of rows to send per INSERT statement when bulk inserting. Batches
+  # smaller than COPY_THRESHOLD are sent in a single statement.
+  DEFAULT_PAGE_SIZE = COPY_THRESHOLD
+  # Number of rows to fetch at a time when streaming query results.
+  DEFAULT_ITERSIZE = 10000
+
   def __init__(
       self, host='127.0.0.1', port=5432, db_name='dfdewey', autocommit=False):
     """Create a PostgreSQL client."""
     super().__init__()
     try:
-      self.db = psycopg2.connect(
-          database=db_name, user='dfdewey', password='password', host=host,
-          port=port)
+      self._connect(host, port, db_name, autocommit)
     except psycopg2.OperationalError as e:
       raise RuntimeError('Unable to connect to PostgreSQL.') from e
-    if autocommit:
-      self.db.set_isolation_level(
-          psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-    self.cursor = self.db.cursor()
 
   def __del__(self):
     """Finalise a PostgreSQL client."""
     try:
-      self.db.commit()
-      self.db.close()
-    except AttributeError:
+      self._release_connection()
+    except (AttributeError, psycopg2.Error):
       pass
 
-  def _execute(self, command):
+  def _connect(self, host, port, db_name, autocommit):
+    """Gets a connection to a database from the connection pool.
+
+    Args:
+      host: Hostname or IP address of the PostgreSQL server
+      port: Port of the PostgreSQL server
+      db_name: Name of the database to connect to
+      autocommit: Flag to set up the database connection as autocommit
+    """
+    self._pool = _get_pool(host, port, db_name)
+    self.db = self._pool.getconn()
+    self.db.autocommit = autocommit
+    self.cursor = self.db.cursor()
+    self._prepared_statements = set()
+
+  def _release_connection(self):
+    """Commits and returns the current connection to its pool.
+
+    The connection is returned even if the commit fails, so that it doesn't
+    count towards the pool's connection limit. The pool rolls back or discards
+    connections that aren't idle.
+    """
+    try:
+      if self._prepared_statements:
+        self.cursor.execute('DEALLOCATE ALL')
+      self.db.commit()
+    finally:
+      self._pool.putconn(self.db)
+
+  def _execute(self, command, params=None):
     """Execute a command in the PostgreSQL database.
 
     Args:
       command: The SQL command to be executed
+      params: Parameters to bind to the command
     """
-    self.cursor.execute(command)
+    self.cursor.execute(command, params)
 
-  def _query(self, query):
+  def _execute_prepared(self, name, statement, params):
+    """Execute a prepared statement, preparing it first if required.
+
+    Prepared statements are only parsed and planned once per connection.
+
+    Args:
+      name: Name of the prepared statement
+      statement: SQL statement using $1, $2, ... as parameter placeholders
+      params: Parameters to bind to the statement
+    """
+    if name not in self._prepared_statements:
+      self.cursor.execute('PREPARE {0:s} AS {1:s}'.format(name, statement))
+      self._prepared_statements.add(name)
+    self.cursor.execute(
+        'EXECUTE {0:s} ({1:s})'.format(name, ', '.join(['%s'] * len(params))),
+        params)
+
+  def _query(self, query, params=None):
     """Query the database.
 
     Args:
       query: SQL query to execute
+      params: Parameters to bind to the query
 
     Returns:
       Rows returned by the query
     """
-    self.cursor.execute(query)
+    self.cursor.execute(query, params)
 
     return self.cursor.fetchall()
 
-  def _query_single_row(self, query):
+  def _query_single_row(self, query, params=None):
     """Query the database for a single row.
 
     Args:
       query: SQL query to execute
+      params: Parameters to bind to the query
 
     Returns:
       Single row returned by the query
     """
-    self.cursor.execute(query)
+    self.cursor.execute(query, params)
 
     return self.cursor.fetchone()
 
-  def bulk_insert(self, table_spec, rows):
+  def _stream_query(self, query, params=None, itersize=DEFAULT_ITERSIZE):
+    """Query the database, streaming the results.
+
+    Rows are fetched from a server-side cursor in batches, so only a single
+    batch is held in memory at any time.
+
+    Args:
+      query: SQL query to execute
+      params: Parameters to bind to the query
+      itersize: Number of rows to fetch from the server at a time
+
+    Yields:
+      Rows returned by the query
+    """
+    # Server-side cursors can only be used outside of a transaction if they are
+    # held open.
+    cursor = self.db.cursor(
+        name='dfdewey_stream_{0:d}'.format(next(_CURSOR_IDS)),
+        withhold=self.db.autocommit)
+    try:
+      cursor.itersize = itersize
+      cursor.execute(query, params)
+      yield from cursor
+    finally:
+      cursor.close()
+
+  def bulk_copy(self, table_name, columns, rows):
+    """Execute a bulk copy into a table.
+
+    Rows are streamed into a temporary staging table using COPY, then inserted
+    into the target table so that existing rows are skipped.
+
+    Args:
+      table_name: Name of the table
+      columns: Names of the columns being copied
+      rows: Iterable of value tuples to be copied
+    """
+    from psycopg2 import sql  # pylint: disable=import-outside-toplevel
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter='\t', lineterminator='\n').writerows(rows)
+    buffer.seek(0)
+
+    table = sql.Identifier(table_name)
+    staging_table = sql.Identifier('_'.join((table_name, 'staging')))
+    column_list = sql.SQL(', ').join(sql.Identifier(c) for c in columns)
+    self.cursor.execute(
+        sql.SQL('CREATE TEMP TABLE {0} (LIKE {1} INCLUDING DEFAULTS)').format(
+            staging_table, table))
+    try:
+      self.cursor.copy_expert(
+          sql.SQL(
+              'COPY {0} ({1}) FROM STDIN WITH (FORMAT csv, DELIMITER E\'\\t\')')
+          .format(staging_table, column_list), buffer)
+      self.cursor.execute(
+          sql.SQL(
+              'INSERT INTO {0} ({1}) SELECT {1} FROM {2} '
+              'ON CONFLICT DO NOTHING').format(
+                  table, column_list, staging_table))
+    finally:
+      self.cursor.execute(sql.SQL('DROP TABLE {0}').format(staging_table))
+
+  def bulk_insert(self, table_spec, rows, page_size=DEFAULT_PAGE_SIZE):
     """Execute a bulk insert into a table.
 
+    Large batches are loaded using COPY, smaller ones using INSERT statements.
+
     Args:
       table_spec: String in the form 'table_name (col1, col2, ..., coln)'
       rows: Array of value tuples to be inserted
+      page_size: Maximum number of rows to insert per statement
     """
+    if len(rows) >= self.COPY_THRESHOLD:
+      table_name, _, columns = table_spec.partition('(')
+      columns = [column.strip() for column in columns.rstrip(') ').split(',')]
+      self.bulk_copy(table_name.strip(), columns, rows)
+      return
+
+    # psycopg2.extras is not imported by the psycopg2 package itself, so defer
+    # it until it is needed.
+    from psycopg2 import extras  # pylint: disable=import-outside-toplevel
     extras.execute_values(
         self.cursor,
         'INSERT INTO {0:s} VALUES %s ON CONFLICT DO NOTHING'.format(table_spec),
-        rows)
+        rows, page_size=page_size)
 
   def create_database(self, db_name):
     """Create a database for the image.
@@ -96,7 +270,9 @@ class PostgresqlDataStore():
     Args:
       db_name: Database name
     """
-    self._execute('CREATE DATABASE {0:s}'.format(db_name))
+    from psycopg2 import sql  # pylint: disable=import-outside-toplevel
+    self._execute(
+        sql.SQL('CREATE DATABASE {0}').format(sql.Identifier(db_name)))
 
   def create_filesystem_database(self):
     """Create a filesystem database for the image."""
@@ -113,7 +289,10 @@ class PostgresqlDataStore():
     Args:
       db_name: The name of the database to drop
     """
-    self._execute('DROP DATABASE {0:s}'.format(db_name))
+    # Idle pooled connections would prevent the database from being dropped
+    _close_pools(db_name)
+    from psycopg2 import sql  # pylint: disable=import-outside-toplevel
+    self._execute(sql.SQL('DROP DATABASE {0}').format(sql.Identifier(db_name)))
 
   def delete_image(self, image_id):
     """Delete an image from the database.
@@ -121,8 +300,7 @@ class PostgresqlDataStore():
     Args:
       image_id: Image identifier
     """
-    self._execute(
-        'DELETE FROM images WHERE image_id = \'{0:s}\''.format(image_id))
+    self._execute('DELETE FROM images WHERE image_id = %s', (image_id,))
 
   def get_case_images(self, case):
     """Get all images for the case.
@@ -136,7 +314,7 @@ class PostgresqlDataStore():
     images = {}
     results = self._query((
         'SELECT image_hash, image_path FROM image_case NATURAL JOIN images '
-        'WHERE case_id = \'{0:s}\'').format(case))
+        'WHERE case_id = %s'), (case,))
     for image_hash, image_path in results:
       images[image_hash] = image_path
     return images
@@ -151,14 +329,34 @@ class PostgresqlDataStore():
     Returns:
       Filename(s) of given inode or None
     """
-    results = self._query((
-        'SELECT filename FROM files '
-        'WHERE inum = {0:d} AND part = \'{1:s}\'').format(inode, location))
+    self._execute_prepared(
+        'get_filenames_from_inode',
+        'SELECT filename FROM files WHERE inum = $1 AND part = $2',
+        (inode, location))
+    results = self.cursor.fetchall()
     filenames = []
     for result in results:
       filenames.append(result[0])
     return filenames
 
+  def get_filenames_from_inodes(self, inodes, location):
+    """Gets filename(s) for multiple inode numbers.
+
+    Args:
+      inodes: Inode numbers of target files
+      location: Partition number
+
+    Returns:
+      Dictionary mapping inode numbers to their filename(s)
+    """
+    results = self._stream_query(
+        'SELECT inum, filename FROM files WHERE part = %s AND inum = ANY(%s)',
+        (location, list(inodes)))
+    filenames = {}
+    for inode, filename in results:
+      filenames.setdefault(inode, []).append(filename)
+    return filenames
+
   def get_image_cases(self, image_id):
     """Get a list of cases the image is linked to.
 
@@ -169,8 +367,7 @@ class PostgresqlDataStore():
       List of cases or None.
     """
     cases = self._query(
-        'SELECT case_id FROM image_case WHERE image_id = \'{0:s}\''.format(
-            image_id))
+        'SELECT case_id FROM image_case WHERE image_id = %s', (image_id,))
     for c in range(len(cases)):
       cases[c] = cases[c][0]
     return cases
@@ -185,8 +382,7 @@ class PostgresqlDataStore():
       Hash for the image stored in PostgreSQL or None.
     """
     image_hash = self._query_single_row(
-        'SELECT image_hash FROM images WHERE image_id = \'{0:s}\''.format(
-            image_id))
+        'SELECT image_hash FROM images WHERE image_id = %s', (image_id,))
     if image_hash:
       return image_hash[0]
     else:
@@ -202,13 +398,32 @@ class PostgresqlDataStore():
     Returns:
       Inode number(s) of the given block or None.
     """
-    inodes = self._query(
-        ('SELECT inum FROM blocks '
-         'WHERE block = {0:d} AND part = \'{1:s}\'').format(block, location))
+    self._execute_prepared(
+        'get_inodes', 'SELECT inum FROM blocks WHERE block = $1 AND part = $2',
+        (block, location))
+    inodes = self.cursor.fetchall()
     for i in range(len(inodes)):
       inodes[i] = inodes[i][0]
     return inodes
 
+  def get_inodes_bulk(self, blocks, location):
+    """Gets inode numbers for multiple block offsets.
+
+    Args:
+      blocks (iterable[int]): block offsets within the image.
+      location (str): Partition location / identifier.
+
+    Returns:
+      Dictionary mapping block offsets to their inode number(s).
+    """
+    results = self._stream_query(
+        'SELECT block, inum FROM blocks WHERE part = %s AND block = ANY(%s)',
+        (location, list(blocks)))
+    inodes = {}
+    for block, inode in results:
+      inodes.setdefault(block, []).append(inode)
+    return inodes
+
   def initialise_database(self):
     """Initialse the image database."""
     self._execute((
@@ -230,8 +445,7 @@ class PostgresqlDataStore():
     """
     self._execute((
         'INSERT INTO images (image_id, image_path, image_hash) '
-        'VALUES (\'{0:s}\', \'{1:s}\', \'{2:s}\')').format(
-            image_id, image_path, image_hash))
+        'VALUES (%s, %s, %s)'), (image_id, image_path, image_hash))
 
   def is_image_in_case(self, image_id, case):
     """Check if an image is attached to a case.
@@ -243,10 +457,9 @@ class PostgresqlDataStore():
     Returns:
       True if the image is attached to the case, otherwise False.
     """
-    image_case = self._query_single_row((
-        'SELECT 1 from image_case '
-        'WHERE image_id = \'{0:s}\' AND case_id = \'{1:s}\'').format(
-            image_id, case))
+    image_case = self._query_single_row(
+        'SELECT 1 from image_case WHERE image_id = %s AND case_id = %s',
+        (image_id, case))
     if image_case:
       return True
     else:
@@ -259,9 +472,9 @@ class PostgresqlDataStore():
       image_id: Image identifier
       case: Case name
     """
-    self._execute((
-        'INSERT INTO image_case (case_id, image_id) '
-        'VALUES (\'{0:s}\', \'{1:s}\')').format(case, image_id))
+    self._execute(
+        'INSERT INTO image_case (case_id, image_id) VALUES (%s, %s)',
+        (case, image_id))
 
   def switch_database(
       self, host='127.0.0.1', port=5432, db_name='dfdewey', autocommit=False):
@@ -273,15 +486,8 @@ class PostgresqlDataStore():
       db_name: Name of the database to connect to
       autocommit: Flag to set up the database connection as autocommit
     """
-    self.db.commit()
-    self.db.close()
-    self.db = psycopg2.connect(
-        database=db_name, user='dfdewey', password='password', host=host,
-        port=port)
-    if autocommit:
-      self.db.set_isolation_level(
-          psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-    self.cursor = self.db.cursor()
+    self._release_connection()
+    self._connect(host, port, db_name, autocommit)
 
   def table_exists(self, table_name, table_schema='public'):
     """Check if a table exists in the database.
@@ -296,8 +502,8 @@ class PostgresqlDataStore():
     self.cursor.execute(
         """
         SELECT 1 FROM information_schema.tables
-        WHERE table_schema = '{0:s}' AND table_name = '{1:s}'""".format(
-            table_schema, table_name))
+        WHERE table_schema = %s AND table_name = %s""",
+        (table_schema, table_name))
 
     return self.cursor.fetchone() is not None
 
@@ -309,10 +515,8 @@ class PostgresqlDataStore():
       case: Case name
     """
     self._execute(
-        """
-        DELETE FROM image_case
-        WHERE case_id = '{0:s}' AND image_id = '{1:s}'""".format(
-            case, image_id))
+        'DELETE FROM image_case WHERE case_id = %s AND image_id = %s',
+        (case, image_id))
 
   def value_exists(self, table_name, column_name, value):
     """Check if a value exists in a table.
@@ -325,9 +529,9 @@ class PostgresqlDataStore():
     Returns:
       True if the value exists, otherwise False
     """
+    from psycopg2 import sql  # pylint: disable=import-outside-toplevel
     self.cursor.execute(
-        """
-        SELECT 1 from {0:s}
-        WHERE {1:s} = '{2:s}'""".format(table_name, column_name, value))
+        sql.SQL('SELECT 1 FROM {0} WHERE {1} = %s').format(
+            sql.Identifier(table_name), sql.Identifier(column_name)), (value,))
 
     return self.cursor.fetchone() is not None
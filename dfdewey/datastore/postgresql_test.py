@@ -17,8 +17,10 @@
 import unittest
 
 import mock
-from psycopg2 import OperationalError
+from psycopg2 import OperationalError, sql
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 
+from dfdewey.datastore import postgresql
 from dfdewey.datastore.postgresql import PostgresqlDataStore
 from dfdewey.utils.image_processor_test import TEST_CASE, TEST_IMAGE, TEST_IMAGE_HASH, TEST_IMAGE_ID
 
@@ -26,6 +28,9 @@ from dfdewey.utils.image_processor_test import TEST_CASE, TEST_IMAGE, TEST_IMAGE
 class PostgresqlTest(unittest.TestCase):
   """Tests for PostgreSQL datastore."""
 
+  def setUp(self):
+    postgresql._POOLS.clear()
+
   def _get_datastore(self):
     """Get a mock postgresql datastore.
 
@@ -36,6 +41,24 @@ class PostgresqlTest(unittest.TestCase):
       db = PostgresqlDataStore(autocommit=True)
     return db
 
+  def test_bulk_copy(self):
+    """Test bulk copy method."""
+    db = self._get_datastore()
+    rows = [(1, 'a.txt', '/p1'), (2, 'b\tc.txt', '/p1')]
+    with mock.patch.object(db.cursor, 'execute') as mock_execute:
+      db.bulk_copy('files', ('inum', 'filename', 'part'), rows)
+      db.cursor.copy_expert.assert_called_once()
+      buffer = db.cursor.copy_expert.call_args.args[1]
+      self.assertEqual(buffer.getvalue(), '1\ta.txt\t/p1\n2\t"b\tc.txt"\t/p1\n')
+      self.assertEqual(mock_execute.call_count, 3)
+
+      # Test the staging table is dropped on error
+      mock_execute.reset_mock()
+      db.cursor.copy_expert.side_effect = OperationalError
+      with self.assertRaises(OperationalError):
+        db.bulk_copy('files', ('inum', 'filename', 'part'), rows)
+      self.assertEqual(mock_execute.call_count, 2)
+
   @mock.patch('psycopg2.extras.execute_values')
   def test_bulk_insert(self, mock_execute_values):
     """Test bulk insert method."""
@@ -46,7 +69,16 @@ class PostgresqlTest(unittest.TestCase):
     expected_sql = (
         'INSERT INTO blocks (block, inum) '
         'VALUES %s ON CONFLICT DO NOTHING')
-    mock_execute_values.assert_called_once_with(db.cursor, expected_sql, rows)
+    mock_execute_values.assert_called_once_with(
+        db.cursor, expected_sql, rows, page_size=db.DEFAULT_PAGE_SIZE)
+
+    # Test large batches are copied
+    mock_execute_values.reset_mock()
+    rows = [(i, i) for i in range(db.COPY_THRESHOLD)]
+    with mock.patch.object(db, 'bulk_copy') as mock_bulk_copy:
+      db.bulk_insert('blocks (block, inum)', rows)
+      mock_bulk_copy.assert_called_once_with('blocks', ['block', 'inum'], rows)
+    mock_execute_values.assert_not_called()
 
   def test_create_filesystem_database(self):
     """Test create filesystem database method."""
@@ -57,10 +89,10 @@ class PostgresqlTest(unittest.TestCase):
       calls = [
           mock.call((
               'CREATE TABLE blocks (block INTEGER, inum INTEGER, part TEXT, '
-              'PRIMARY KEY (block, inum, part))')),
+              'PRIMARY KEY (block, inum, part))'), None),
           mock.call((
               'CREATE TABLE files (inum INTEGER, filename TEXT, part TEXT, '
-              'PRIMARY KEY (inum, filename, part))'))
+              'PRIMARY KEY (inum, filename, part))'), None)
       ]
       mock_execute.assert_has_calls(calls)
 
@@ -68,10 +100,13 @@ class PostgresqlTest(unittest.TestCase):
     """Test delete filesystem database method."""
     db = self._get_datastore()
     db_name = ''.join(('fs', TEST_IMAGE_HASH))
+    postgresql._POOLS[('127.0.0.1', 5432, db_name)] = mock.Mock()
     with mock.patch.object(db.cursor, 'execute') as mock_execute:
       db.delete_filesystem_database(db_name)
+      self.assertEqual(
+          list(postgresql._POOLS), [('127.0.0.1', 5432, 'dfdewey')])
       mock_execute.assert_called_once_with(
-          'DROP DATABASE {0:s}'.format(db_name))
+          sql.SQL('DROP DATABASE {0}').format(sql.Identifier(db_name)), None)
 
   def test_delete_image(self):
     """Test delete image method."""
@@ -79,7 +114,7 @@ class PostgresqlTest(unittest.TestCase):
     with mock.patch.object(db.cursor, 'execute') as mock_execute:
       db.delete_image(TEST_IMAGE_ID)
       mock_execute.assert_called_once_with(
-          'DELETE FROM images WHERE image_id = \'{0:s}\''.format(TEST_IMAGE_ID))
+          'DELETE FROM images WHERE image_id = %s', (TEST_IMAGE_ID,))
 
   def test_execute(self):
     """Test execute method."""
@@ -88,7 +123,7 @@ class PostgresqlTest(unittest.TestCase):
         'CREATE TABLE images (image_path TEXT, image_hash TEXT PRIMARY KEY)')
     with mock.patch.object(db.cursor, 'execute') as mock_execute:
       db._execute(command)
-      mock_execute.assert_called_once_with(command)
+      mock_execute.assert_called_once_with(command, None)
 
   def test_get_case_images(self):
     """Test get case images method."""
@@ -108,6 +143,18 @@ class PostgresqlTest(unittest.TestCase):
       self.assertEqual(filenames[0], 'test.txt')
       self.assertEqual(filenames[1], 'test.txt:ads')
 
+  def test_get_filenames_from_inodes(self):
+    """Test get filenames from inodes method."""
+    db = self._get_datastore()
+    with mock.patch.object(db, '_stream_query', return_value=iter(
+        [(42, 'test.txt'), (42, 'test.txt:ads'), (43, 'test2.txt')])):
+      filenames = db.get_filenames_from_inodes({42, 43, 44}, '/p1')
+      self.assertEqual(
+          filenames, {
+              42: ['test.txt', 'test.txt:ads'],
+              43: ['test2.txt']
+          })
+
   def test_get_image_cases(self):
     """Test get image cases method."""
     db = self._get_datastore()
@@ -132,6 +179,52 @@ class PostgresqlTest(unittest.TestCase):
       inodes = db.get_inodes(1234, '/p1')
       self.assertEqual(inodes, [10, 19])
 
+  def test_execute_prepared(self):
+    """Test execute prepared method."""
+    db = self._get_datastore()
+    statement = 'SELECT inum FROM blocks WHERE block = $1 AND part = $2'
+    with mock.patch.object(db.cursor, 'execute') as mock_execute:
+      db._execute_prepared('get_inodes', statement, (1234, '/p1'))
+      db._execute_prepared('get_inodes', statement, (5678, '/p1'))
+      mock_execute.assert_has_calls([
+          mock.call('PREPARE get_inodes AS {0:s}'.format(statement)),
+          mock.call('EXECUTE get_inodes (%s, %s)', (1234, '/p1')),
+          mock.call('EXECUTE get_inodes (%s, %s)', (5678, '/p1'))
+      ])
+      self.assertEqual(mock_execute.call_count, 3)
+
+    # Prepared statements don't survive switching database
+    with mock.patch('psycopg2.connect'):
+      db.switch_database(db_name='dfdewey')
+    self.assertEqual(db._prepared_statements, set())
+
+  def test_get_inodes_bulk(self):
+    """Test get inodes bulk method."""
+    db = self._get_datastore()
+    with mock.patch.object(db, '_stream_query', return_value=iter(
+        [(1234, 10), (1234, 19), (1235, 10)])) as mock_query:
+      inodes = db.get_inodes_bulk([1234, 1235], '/p1')
+      mock_query.assert_called_once_with(
+          'SELECT block, inum FROM blocks WHERE part = %s AND block = ANY(%s)',
+          ('/p1', [1234, 1235]))
+      self.assertEqual(inodes, {1234: [10, 19], 1235: [10]})
+
+  def test_stream_query(self):
+    """Test stream query method."""
+    db = self._get_datastore()
+    server_cursor = mock.MagicMock()
+    server_cursor.__iter__.return_value = iter([(1,), (2,)])
+    with mock.patch.object(db.db, 'cursor', return_value=server_cursor):
+      rows = db._stream_query(
+          'SELECT inum FROM files WHERE part = %s', ('/p1',))
+      self.assertEqual(list(rows), [(1,), (2,)])
+      self.assertTrue(db.db.cursor.call_args.kwargs['name'])
+      self.assertTrue(db.db.cursor.call_args.kwargs['withhold'])
+      server_cursor.execute.assert_called_once_with(
+          'SELECT inum FROM files WHERE part = %s', ('/p1',))
+      self.assertEqual(server_cursor.itersize, db.DEFAULT_ITERSIZE)
+      server_cursor.close.assert_called_once()
+
   @mock.patch('psycopg2.connect')
   def test_init(self, mock_connect):
     """Test init method."""
@@ -144,12 +237,12 @@ class PostgresqlTest(unittest.TestCase):
     db = self._get_datastore()
     calls = [
         mock.call(
-            'CREATE TABLE images (image_id TEXT PRIMARY KEY, image_path TEXT, image_hash TEXT)'
-        ),
+            'CREATE TABLE images (image_id TEXT PRIMARY KEY, image_path TEXT, image_hash TEXT)',
+            None),
         mock.call((
             'CREATE TABLE image_case ('
             'case_id TEXT, image_id TEXT REFERENCES images(image_id), '
-            'PRIMARY KEY (case_id, image_id))'))
+            'PRIMARY KEY (case_id, image_id))'), None)
     ]
     with mock.patch.object(db.cursor, 'execute') as mock_execute:
       db.initialise_database()
@@ -162,8 +255,7 @@ class PostgresqlTest(unittest.TestCase):
       db.insert_image(TEST_IMAGE_ID, TEST_IMAGE, TEST_IMAGE_HASH)
       mock_execute.assert_called_once_with((
           'INSERT INTO images (image_id, image_path, image_hash) '
-          'VALUES (\'{0:s}\', \'{1:s}\', \'{2:s}\')').format(
-              TEST_IMAGE_ID, TEST_IMAGE, TEST_IMAGE_HASH))
+          'VALUES (%s, %s, %s)'), (TEST_IMAGE_ID, TEST_IMAGE, TEST_IMAGE_HASH))
 
   def test_is_image_in_case(self):
     """Test is image in case method."""
@@ -180,9 +272,9 @@ class PostgresqlTest(unittest.TestCase):
     db = self._get_datastore()
     with mock.patch.object(db.cursor, 'execute') as mock_execute:
       db.link_image_to_case(TEST_IMAGE_ID, TEST_CASE)
-      mock_execute.assert_called_once_with((
-          'INSERT INTO image_case (case_id, image_id) '
-          'VALUES (\'{0:s}\', \'{1:s}\')').format(TEST_CASE, TEST_IMAGE_ID))
+      mock_execute.assert_called_once_with(
+          'INSERT INTO image_case (case_id, image_id) VALUES (%s, %s)',
+          (TEST_CASE, TEST_IMAGE_ID))
 
   def test_query(self):
     """Test query method."""
@@ -207,11 +299,32 @@ class PostgresqlTest(unittest.TestCase):
   def test_switch_database(self):
     """Test switch database method."""
     db = self._get_datastore()
+    db_name = ''.join(('fs', TEST_IMAGE_HASH))
+    connection = db.db
+    connection.closed = False
+    connection.info.transaction_status = TRANSACTION_STATUS_IDLE
     with mock.patch('psycopg2.connect') as mock_connect:
-      db.switch_database(db_name='dfdewey', autocommit=True)
+      db.switch_database(db_name=db_name, autocommit=True)
       mock_connect.assert_called_once_with(
-          database='dfdewey', user='dfdewey', password='password',
+          database=db_name, user='dfdewey', password='password',
           host='127.0.0.1', port=5432)
+      self.assertTrue(db.db.autocommit)
+      connection.commit.assert_called_once()
+
+      # Test the pooled connection is reused
+      mock_connect.reset_mock()
+      db.switch_database(db_name='dfdewey')
+      mock_connect.assert_not_called()
+      self.assertIs(db.db, connection)
+      self.assertFalse(db.db.autocommit)
+
+      # Test the connection is returned to the pool if the commit fails
+      connection.commit.side_effect = OperationalError
+      with mock.patch.object(db._pool, 'putconn') as mock_putconn:
+        with self.assertRaises(OperationalError):
+          db.switch_database(db_name=db_name)
+        mock_putconn.assert_called_once_with(connection)
+      connection.commit.side_effect = None
 
   def test_table_exists(self):
     """Test table exists method."""
@@ -462,23 +462,62 @@ class ImageProcessor():
 
     return partition_location, partition_offset
 
-  def _index_record(self, index_name, string_record):
-    """Index a single record.
+  @staticmethod
+  def _get_event(string_record):
+    """Get the OpenSearch event for a record.
 
     Args:
-      index_name: ID of the opensearch index.
       string_record: String record to be indexed.
 
     Returns:
-      Number of records processed
+      Event dictionary
     """
-    json_record = {
+    return {
         'image': string_record.image,
         'offset': string_record.offset,
         'file_offset': string_record.file_offset,
         'data': string_record.data
     }
-    return self.opensearch.import_event(index_name, event=json_record)
+
+  def _read_strings(self, string_list):
+    """Read the extracted strings.
+
+    Args:
+      string_list: Path to the bulk_extractor wordlist.
+
+    Yields:
+      Event dictionaries for the extracted strings.
+    """
+    records = 0
+    with open(string_list, 'r') as strings:
+      for line in strings:
+        # Ignore the comments added by bulk_extractor
+        if not line.startswith('#'):
+          string_record = _StringRecord()
+          string_record.image = self.image_hash
+
+          # Split each string into offset and data
+          line = line.split('\t')
+          offset = line[0]
+          data = '\t'.join(line[1:])
+
+          # If the string is from a decoded / decompressed stream, split the
+          # offset into image offset and file offset
+          if offset.find('-') > 0:
+            offset = offset.split('-')
+            image_offset = offset[0]
+            file_offset = '-'.join(offset[1:])
+            string_record.offset = int(image_offset)
+            string_record.file_offset = file_offset
+          else:
+            string_record.offset = int(offset)
+
+          string_record.data = data
+          yield self._get_event(string_record)
+
+          records += 1
+          if records % STRING_INDEXING_LOG_INTERVAL == 0:
+            log.info('Read %d records...', records)
 
   def _index_strings(self):
     """Index the extracted strings."""
@@ -497,37 +536,8 @@ class ImageProcessor():
       log.info('Index %s created.', index_name)
 
       string_list = os.path.join(self.output_path, 'wordlist.txt')
-      records = 0
-      with open(string_list, 'r') as strings:
-        for line in strings:
-          # Ignore the comments added by bulk_extractor
-          if not line.startswith('#'):
-            string_record = _StringRecord()
-            string_record.image = self.image_hash
-
-            # Split each string into offset and data
-            line = line.split('\t')
-            offset = line[0]
-            data = '\t'.join(line[1:])
-
-            # If the string is from a decoded / decompressed stream, split the
-            # offset into image offset and file offset
-            if offset.find('-') > 0:
-              offset = offset.split('-')
-              image_offset = offset[0]
-              file_offset = '-'.join(offset[1:])
-              string_record.offset = int(image_offset)
-              string_record.file_offset = file_offset
-            else:
-              string_record.offset = int(offset)
-
-            string_record.data = data
-            records = self._index_record(index_name, string_record)
-
-            if records % STRING_INDEXING_LOG_INTERVAL == 0:
-              log.info('Indexed %d records...', records)
-      # Flush the import buffer
-      records = self.opensearch.import_event(index_name)
+      records = self.opensearch.bulk_import_events(
+          index_name, self._read_strings(string_list))
       log.info('Indexed %d records...', records)
 
   def _parse_filesystems(self):
@@ -22,6 +22,7 @@ from dfvfs.helpers import volume_scanner
 from dfvfs.lib import definitions as dfvfs_definitions
 from dfvfs.path import factory as path_spec_factory
 import mock
+from psycopg2 import sql
 
 from dfdewey.utils.image_processor import (
     _StringRecord, FileEntryScanner, ImageProcessor, ImageProcessorOptions)
@@ -212,68 +213,75 @@ class ImageProcessorTest(unittest.TestCase):
     self.assertEqual(location, '/p1')
     self.assertEqual(start_offset, 1048576)
 
-  @mock.patch('dfdewey.datastore.opensearch.OpenSearchDataStore')
-  def test_index_record(self, mock_opensearch):
-    """Test index record method."""
-    image_processor = self._get_image_processor()
-
-    index_name = ''.join(('es', TEST_IMAGE_HASH))
+  def test_get_event(self):
+    """Test get event method."""
     string_record = _StringRecord()
     string_record.image = TEST_IMAGE_HASH
     string_record.offset = 1234567
     string_record.data = 'test string'
 
-    image_processor.opensearch = mock_opensearch
-    image_processor._index_record(index_name, string_record)
-
     json_record = {
         'image': string_record.image,
         'offset': string_record.offset,
         'file_offset': string_record.file_offset,
         'data': string_record.data
     }
-    mock_opensearch.import_event.assert_called_once_with(
-        index_name, event=json_record)
+    self.assertEqual(ImageProcessor._get_event(string_record), json_record)
 
+  @mock.patch.dict('dfdewey.datastore.opensearch._CLIENTS', clear=True)
   @mock.patch('opensearchpy.client.IndicesClient')
-  @mock.patch('dfdewey.utils.image_processor.ImageProcessor._index_record')
   @mock.patch('dfdewey.datastore.opensearch.OpenSearchDataStore.index_exists')
-  @mock.patch('dfdewey.datastore.opensearch.OpenSearchDataStore.import_event')
+  @mock.patch(
+      'dfdewey.datastore.opensearch.OpenSearchDataStore.bulk_import_events')
   @mock.patch('dfdewey.datastore.opensearch.OpenSearchDataStore.create_index')
   def test_index_strings(
-      self, mock_create_index, mock_import_event, mock_index_exists,
-      mock_index_record, _):
+      self, mock_create_index, mock_bulk_import_events, mock_index_exists, _):
     """Test index strings method."""
     image_processor = self._get_image_processor()
     current_path = os.path.abspath(os.path.dirname(__file__))
     image_processor.output_path = os.path.join(
         current_path, '..', '..', 'test_data')
+    events = []
+
+    def _bulk_import_events(_, event_iterator):
+      events.extend(event_iterator)
+      return len(events)
+
+    mock_bulk_import_events.side_effect = _bulk_import_events
 
     # Test index already exists
     mock_index_exists.return_value = True
     image_processor._index_strings()
-    mock_index_record.assert_not_called()
+    mock_bulk_import_events.assert_not_called()
 
     # Test reindex flag
     image_processor.options.reindex = True
     image_processor._index_strings()
     mock_create_index.assert_called_once_with(
         index_name=''.join(('es', TEST_IMAGE_HASH)))
-    self.assertEqual(mock_index_record.call_count, 3)
-    mock_import_event.assert_called_once()
+    mock_bulk_import_events.assert_called_once()
+    self.assertEqual(len(events), 3)
     image_processor.options.reindex = False
     mock_create_index.reset_mock()
-    mock_index_record.reset_mock()
-    mock_import_event.reset_mock()
+    mock_bulk_import_events.reset_mock()
+    events = []
 
     # Test new index
     mock_index_exists.return_value = False
-    mock_index_record.return_value = 10000000
     image_processor._index_strings()
     mock_create_index.assert_called_once_with(
         index_name=''.join(('es', TEST_IMAGE_HASH)))
-    self.assertEqual(mock_index_record.call_count, 3)
-    mock_import_event.assert_called_once()
+    mock_bulk_import_events.assert_called_once()
+    self.assertEqual(len(events), 3)
+    self.assertEqual(
+        events[0], {
+            'image': TEST_IMAGE_HASH,
+            'offset': 2681139,
+            'file_offset': None,
+            'data': '            Quoth the Raven \n'
+        })
+    self.assertEqual(events[2]['offset'], 19998720)
+    self.assertEqual(events[2]['file_offset'], 'ZIP-516')
 
   @mock.patch('psycopg2.connect')
   @mock.patch('dfdewey.utils.image_processor.ImageProcessor._already_parsed')
@@ -296,7 +304,8 @@ class ImageProcessorTest(unittest.TestCase):
     # Test reparse flag
     image_processor.options.reparse = True
     image_processor._parse_filesystems()
-    mock_execute.assert_any_call('DROP DATABASE {0:s}'.format(db_name))
+    mock_execute.assert_any_call(
+        sql.SQL('DROP DATABASE {0}').format(sql.Identifier(db_name)))
     mock_execute.reset_mock()
     mock_switch_database.reset_mock()
 
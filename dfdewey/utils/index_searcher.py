@@ -32,6 +32,8 @@ from dfdewey.utils.image_processor import FileEntryScanner
 DATA_COLUMN_WIDTH = 110
 TEXT_HIGHLIGHT = '\u001b[31m\u001b[1m'
 TEXT_RESET = '\u001b[0m'
+# Document fields needed to display search hits
+HIT_FIELDS = ('offset', 'file_offset', 'data')
 
 log = logging.getLogger('dfdewey.index_searcher')
 
@@ -99,18 +101,20 @@ class IndexSearcher():
     else:
       self.images = self.postgresql.get_case_images(self.case)
 
-  def _get_filenames_from_offset(self, image_path, image_hash, offset):
-    """Gets filename(s) given a byte offset within an image.
+  def _get_filenames_from_offsets(self, image_path, image_hash, offsets):
+    """Gets filename(s) given byte offsets within an image.
 
     Args:
       image_path: source image path.
       image_hash: source image hash.
-      offset: byte offset within the image.
+      offsets: byte offsets within the image.
 
     Returns:
-      Filename(s) allocated to the given offset, or None.
+      Dictionary mapping each offset to the filename(s) allocated to it.
     """
-    filenames = []
+    filenames = {offset: [] for offset in offsets}
+    if not filenames:
+      return filenames
 
     database_name = ''.join(('fs', image_hash))
     if self.config:
@@ -128,29 +132,42 @@ class IndexSearcher():
     except dfvfs_errors.ScannerError as e:
       log.error('Error scanning for partitions: %s', e)
 
-    hit_location = None
-    partition_offset = None
-    for location, extent in volume_extents.items():
-      if not extent['end']:
-        # Image is of a single volume
-        hit_location = location
-        partition_offset = extent['start']
-      elif extent['start'] <= offset < extent['end']:
-        hit_location = location
-        partition_offset = extent['start']
-
-    if partition_offset is not None:
+    # Group the offsets by the volume they fall within
+    volume_offsets = {}
+    for offset in filenames:
+      hit_location = None
+      partition_offset = None
+      for location, extent in volume_extents.items():
+        if not extent['end']:
+          # Image is of a single volume
+          hit_location = location
+          partition_offset = extent['start']
+        elif extent['start'] <= offset < extent['end']:
+          hit_location = location
+          partition_offset = extent['start']
+      if partition_offset is not None:
+        volume_offsets.setdefault((hit_location, partition_offset),
+                                  []).append(offset)
+
+    for (hit_location, partition_offset), hit_offsets in volume_offsets.items():
       try:
         img = pytsk3.Img_Info(image_path)
         filesystem = pytsk3.FS_Info(img, offset=partition_offset)
         block_size = filesystem.info.block_size
       except TypeError as e:
         log.error('Error opening image: %s', e)
-
-      inodes = self.postgresql.get_inodes(
-          int((offset - partition_offset) / block_size), hit_location)
-
-      if inodes:
+        continue
+
+      inodes_by_block = self.postgresql.get_inodes_bulk({
+          int((offset - partition_offset) / block_size)
+          for offset in hit_offsets
+      }, hit_location)
+
+      hit_inodes = {}
+      for offset in hit_offsets:
+        inodes = inodes_by_block.get(
+            int((offset - partition_offset) / block_size), [])
+        hit_inodes[offset] = []
         for inode in inodes:
           # Account for resident files
           if (inode == 0 and
@@ -164,11 +181,17 @@ class IndexSearcher():
               mft_record_size = mft_record_size * block_size
             inode = self._get_ntfs_resident_inode((offset - partition_offset),
                                                   filesystem, mft_record_size)
-
-          inode_filenames = self.postgresql.get_filenames_from_inode(
-              inode, hit_location)
-          filename = '\n'.join(inode_filenames)
-          filenames.append('{0:s} ({1:d})'.format(filename, inode))
+          hit_inodes[offset].append(inode)
+
+      all_inodes = {inode for inodes in hit_inodes.values() for inode in inodes}
+      if not all_inodes:
+        continue
+      inode_filenames = self.postgresql.get_filenames_from_inodes(
+          all_inodes, hit_location)
+      for offset, inodes in hit_inodes.items():
+        for inode in inodes:
+          filename = '\n'.join(inode_filenames.get(inode, []))
+          filenames[offset].append('{0:s} ({1:d})'.format(filename, inode))
 
     return filenames
 
@@ -282,7 +305,8 @@ class IndexSearcher():
         table_data = []
         for term in search_terms:
           term = ''.join(('"', term.strip(), '"'))
-          results = self.opensearch.search(index, term)
+          # Only the hit count is needed
+          results = self.opensearch.search(index, term, size=0)
           hit_count = results['hits']['total']['value']
           if hit_count > 0:
             search_results[image_hash]['results'][term] = hit_count
@@ -311,11 +335,14 @@ class IndexSearcher():
       search_results[image_hash]['image'] = image_path
       log.info('Searching %s (%s) for "%s"', image_path, image_hash, query)
       index = ''.join(('es', image_hash))
-      results = self.opensearch.search(index, query)
+      results = self.opensearch.search(index, query, source_includes=HIT_FIELDS)
       result_count = results['hits']['total']['value']
       time_taken = results['took']
 
       results = results['hits']['hits']
+      hit_filenames = self._get_filenames_from_offsets(
+          image_path, image_hash,
+          [result['_source']['offset'] for result in results])
       hits = []
       for result in results:
         hit = _SearchHit()
@@ -329,9 +356,8 @@ class IndexSearcher():
           file_offset = '\n'.join(file_offset)
           offset = '\n'.join((offset, file_offset))
         hit.offset = offset
-        filenames = self._get_filenames_from_offset(
-            image_path, image_hash, result['_source']['offset'])
-        filenames = self._wrap_filenames(filenames)
+        filenames = self._wrap_filenames(
+            list(hit_filenames[result['_source']['offset']]))
         hit.filename = '\n'.join(filenames)
         hit.data = result['_source']['data'].strip()
         re_query = query.replace('*', '.*')
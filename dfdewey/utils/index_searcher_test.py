@@ -61,56 +61,66 @@ class IndexSearcherTest(unittest.TestCase):
     self.assertEqual(index_searcher.images['hash1'], 'image1.dd')
     self.assertEqual(index_searcher.images['hash2'], 'image2.dd')
 
-  @mock.patch('dfdewey.datastore.postgresql.PostgresqlDataStore.get_inodes')
   @mock.patch(
-      'dfdewey.datastore.postgresql.PostgresqlDataStore.get_filenames_from_inode'
+      'dfdewey.datastore.postgresql.PostgresqlDataStore.get_inodes_bulk')
+  @mock.patch(
+      'dfdewey.datastore.postgresql.PostgresqlDataStore.get_filenames_from_inodes'
   )
   @mock.patch(
       'dfdewey.datastore.postgresql.PostgresqlDataStore.switch_database')
-  def test_get_filenames_from_offset(
-      self, mock_switch_database, mock_get_filenames_from_inode,
-      mock_get_inodes):
-    """Test get filenames from offset method."""
+  def test_get_filenames_from_offsets(
+      self, mock_switch_database, mock_get_filenames_from_inodes,
+      mock_get_inodes_bulk):
+    """Test get filenames from offsets method."""
     index_searcher = self._get_index_searcher()
     current_path = os.path.abspath(os.path.dirname(__file__))
     image_path = os.path.join(current_path, '..', '..', 'test_data', 'test.dd')
     # Test offset not within a file
-    filenames = index_searcher._get_filenames_from_offset(
-        image_path, TEST_IMAGE_HASH, 1048579)
+    mock_get_inodes_bulk.return_value = {}
+    filenames = index_searcher._get_filenames_from_offsets(
+        image_path, TEST_IMAGE_HASH, [1048579])
     mock_switch_database.assert_called_once_with(
         db_name=''.join(('fs', TEST_IMAGE_HASH)))
     self.assertIsInstance(index_searcher.scanner, FileEntryScanner)
-    mock_get_inodes.assert_called_once_with(0, '/p1')
-    self.assertEqual(filenames, [])
-
-    # Test offset within a file
-    mock_get_inodes.reset_mock()
-    mock_get_inodes.return_value = [0]
-    mock_get_filenames_from_inode.return_value = ['adams.txt']
-    filenames = index_searcher._get_filenames_from_offset(
-        image_path, TEST_IMAGE_HASH, 1133936)
-    mock_get_inodes.assert_called_once_with(20, '/p1')
-    mock_get_filenames_from_inode.assert_called_once_with(67, '/p1')
-    self.assertEqual(filenames, ['adams.txt (67)'])
+    mock_get_inodes_bulk.assert_called_once_with({0}, '/p1')
+    mock_get_filenames_from_inodes.assert_not_called()
+    self.assertEqual(filenames, {1048579: []})
+
+    # Test offsets within a file
+    mock_get_inodes_bulk.reset_mock()
+    mock_get_inodes_bulk.return_value = {20: [0]}
+    mock_get_filenames_from_inodes.return_value = {67: ['adams.txt']}
+    filenames = index_searcher._get_filenames_from_offsets(
+        image_path, TEST_IMAGE_HASH, [1133936, 1048579])
+    mock_get_inodes_bulk.assert_called_once_with({0, 20}, '/p1')
+    mock_get_filenames_from_inodes.assert_called_once_with({67}, '/p1')
+    self.assertEqual(filenames, {1133936: ['adams.txt (67)'], 1048579: []})
 
     # Test volume image
-    mock_get_inodes.reset_mock()
-    mock_get_inodes.return_value = [2]
-    mock_get_filenames_from_inode.reset_mock()
-    mock_get_filenames_from_inode.return_value = []
+    mock_get_inodes_bulk.reset_mock()
+    mock_get_inodes_bulk.return_value = {326: [2]}
+    mock_get_filenames_from_inodes.reset_mock()
+    mock_get_filenames_from_inodes.return_value = {}
     image_path = os.path.join(
         current_path, '..', '..', 'test_data', 'test_volume.dd')
-    filenames = index_searcher._get_filenames_from_offset(
-        image_path, TEST_IMAGE_HASH, 334216)
-    mock_get_inodes.assert_called_once_with(326, '/')
-    mock_get_filenames_from_inode.assert_called_once_with(2, '/')
-    self.assertEqual(filenames, [' (2)'])
+    filenames = index_searcher._get_filenames_from_offsets(
+        image_path, TEST_IMAGE_HASH, [334216])
+    mock_get_inodes_bulk.assert_called_once_with({326}, '/')
+    mock_get_filenames_from_inodes.assert_called_once_with({2}, '/')
+    self.assertEqual(filenames, {334216: [' (2)']})
 
     # Test missing image
     index_searcher.scanner = None
-    filenames = index_searcher._get_filenames_from_offset(
-        'test.dd', TEST_IMAGE_HASH, 1048579)
-    self.assertEqual(filenames, [])
+    filenames = index_searcher._get_filenames_from_offsets(
+        'test.dd', TEST_IMAGE_HASH, [1048579])
+    self.assertEqual(filenames, {1048579: []})
+
+    # Test no offsets
+    mock_switch_database.reset_mock()
+    filenames = index_searcher._get_filenames_from_offsets(
+        image_path, TEST_IMAGE_HASH, [])
+    self.assertEqual(filenames, {})
+    mock_switch_database.assert_not_called()
 
   def test_highlight_hit(self):
     """Test highlight hit method."""
@@ -17,15 +17,7 @@
 
 import sys
 
-try:
-  from setuptools import find_packages, setup
-except ImportError:
-  from distutils.core import find_packages, setup
-
-try:
-  from setuptools.commands.sdist import sdist
-except ImportError:
-  from distutils.command.sdist import sdist
+from setuptools import find_packages, setup
 
 import dfdewey
 